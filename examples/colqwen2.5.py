@@ -1,59 +1,222 @@
-import base64
+import binascii
 import glob
+import mmap
 import os
-from typing import List
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 
+import numpy as np
 import requests
 import torch
+from requests.adapters import HTTPAdapter
+
+try:  # optional: JIT MaxSim kernel for small CPU workloads (pip install numba)
+    import numba
+except ImportError:
+    numba = None
+
+# Reuse one keep-alive connection pool for every call to the embedding server
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=32))
+
+# Data-URI mime type per file extension; anything else is sent as PNG
+_MIME_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+
+# Scratch buffers for late_interaction_score, keyed by (name, shape, dtype, device), least
+# recently used first. A call uses up to six (three per full and partial block), so the cap
+# keeps the last couple of shapes without pinning one dots buffer per patch count seen.
+_SCORE_BUFS: OrderedDict[tuple, torch.Tensor] = OrderedDict()
+MAX_SCORE_BUFS = 12
+
+
+def _score_buf(name: str, shape: Tuple[int, ...], dtype: torch.dtype, device: torch.device) -> torch.Tensor:
+    key = (name, shape, dtype, device)
+    buf = _SCORE_BUFS.get(key)
+    if buf is not None:
+        _SCORE_BUFS.move_to_end(key)
+        return buf
+    buf = _SCORE_BUFS[key] = torch.empty(shape, dtype=dtype, device=device)
+    if len(_SCORE_BUFS) > MAX_SCORE_BUFS:
+        _SCORE_BUFS.popitem(last=False)
+    return buf
+
+
+# Below this many patches per doc, BLAS call overhead outweighs the GEMM itself on CPU
+NUMBA_MAX_PATCHES = 256
+
+if numba is not None:
+    # fastmath without "ninf"/"nnan": the running max starts at -inf (and stays there for a
+    # fully masked doc), so the compiler must not assume infinities away
+    @numba.njit(parallel=True, fastmath={"contract", "reassoc", "arcp", "nsz", "afn"}, cache=True)
+    def _maxsim_numba(q, d, scale, lengths, out):
+        """
+        q: (n_queries, n_q_tokens, dim) float32, d: (n_docs, n_patches, dim),
+        scale: (n_docs, n_patches) float32, lengths: (n_docs,) valid patches per doc,
+        out: (n_queries, n_docs) float32.
+
+        Tiles 8 query tokens × 64 patches so the query tile stays hot in L1, and
+        keeps a running max per query token instead of materialising the dots.
+        """
+        n_queries, n_q_tokens, dim = q.shape
+        n_docs, n_patches, _ = d.shape
+        for doc in numba.prange(n_docs):
+            n_valid = lengths[doc]
+            best = np.empty(8, dtype=np.float32)
+            for qi in range(n_queries):
+                total = 0.0
+                for t0 in range(0, n_q_tokens, 8):
+                    t1 = min(t0 + 8, n_q_tokens)
+                    best[:] = -np.inf
+                    for p0 in range(0, n_valid, 64):
+                        p1 = min(p0 + 64, n_valid)
+                        for t in range(t0, t1):
+                            for p in range(p0, p1):
+                                acc = np.float32(0.0)
+                                for k in range(dim):
+                                    acc += q[qi, t, k] * d[doc, p, k]
+                                acc *= scale[doc, p]
+                                if acc > best[t - t0]:
+                                    best[t - t0] = acc
+                    for t in range(t1 - t0):
+                        total += best[t]
+                out[qi, doc] = total
+
+
+def quantize_int8(doc_emb: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Quantize doc embeddings to int8 with one symmetric scale per patch vector.
+    Returns: (int8 tensor of doc_emb's shape, float32 scales of shape (n_docs, n_patches)).
+    """
+    scale = doc_emb.abs().amax(dim=-1).float().clamp(min=1e-8) / 127
+    quantized = torch.round(doc_emb / scale[..., None]).clamp(-127, 127).to(torch.int8)
+    return quantized, scale
+
+
+def to_patch_major(doc_emb: torch.Tensor) -> torch.Tensor:
+    """
+    Lay out doc embeddings as a contiguous (n_docs, dim, n_patches) store.
+    ``q @ doc`` then yields (tokens, n_patches) with patches as the stride-1 axis,
+    so the following max over patches reads contiguous memory.
+    """
+    return doc_emb.transpose(1, 2).contiguous()
 
 
 def late_interaction_score(
     query_emb: torch.Tensor,  # (n_queries, n_query_tokens, dim)   e.g. (2, 6, 128)
     doc_emb: torch.Tensor,  # (n_docs,    n_doc_patches,  dim)   e.g. (1, 397, 128)
+    block_size: int = 8,
+    doc_scale: Optional[torch.Tensor] = None,  # (n_docs, n_doc_patches) when doc_emb is int8
+    patch_major: bool = False,  # doc_emb is (n_docs, dim, n_doc_patches), see to_patch_major
+    doc_mask: Optional[torch.Tensor] = None,  # (n_docs, n_doc_patches) bool, False on padding
 ) -> torch.Tensor:
     """
     Compute ColQwen / ColBERT-style late interaction score (sum of MaxSim operations).
     Returns: tensor of shape (n_queries, n_docs) with similarity scores.
     Higher = more similar.
+
+    Documents are scored ``block_size`` at a time, so the full
+    (n_queries, n_q_tokens, n_docs, n_patches) similarity tensor is never
+    materialised — peak memory only grows with the block, not the corpus.
+    The per-block intermediates are written into cached scratch buffers, so
+    repeated calls with the same shapes do not allocate them again.
+
+    If ``doc_scale`` is given, ``doc_emb`` is an int8 store from ``quantize_int8``;
+    each block is widened on the fly and the per-patch scale applied to the dots.
+
+    Whatever the store dtype (fp32, fp16, bf16 or int8), each block is scored in fp32:
+    the dots, the per-token max and the sum are all kept in single precision.
+
+    ``doc_mask`` marks the real patches of a padded batch (see ``get_embeddings``);
+    padded patches never win the max. Padding must come after the real patches.
+
+    With numba installed, small CPU workloads (fewer than ``NUMBA_MAX_PATCHES``
+    patches per doc) use a tiled JIT kernel instead of torch.bmm.
     """
-    # Ensure same dtype & device
-    query_emb = query_emb.to(doc_emb.dtype).to(doc_emb.device)
-    # Expand dims so we can broadcast:
-    # query: (n_q, n_qtok, 1,    dim)
-    # doc:   (1,   1,      n_doc, n_patch, dim)  wait — better way below
-
-    # Core operation: dot product between every query token and every doc patch
-    # (n_queries, n_q_tokens, n_docs, n_patches)
-    dots = torch.einsum(
-        "qtd,pcd->qtpc",
-        query_emb,
-        doc_emb,  # q=query batch, t=token, p=doc batch, c=patch, d=dim  # q t d  # p c d
-    )
-
-    # For each query token → max similarity to any patch in that doc
-    # → shape (n_queries, n_q_tokens, n_docs)
-    max_sim_per_token = dots.max(dim=-1).values  # max over patches (dim=-1)
-
-    # Sum over query tokens → final score per query-doc pair
-    # shape (n_queries, n_docs)
-    scores = max_sim_per_token.sum(dim=1)
+    if patch_major:
+        n_docs, dim, n_patches = doc_emb.shape
+    else:
+        n_docs, n_patches, dim = doc_emb.shape
+
+    if numba is not None and doc_emb.device.type == "cpu" and n_patches < NUMBA_MAX_PATCHES:
+        if patch_major:
+            doc_emb = doc_emb.transpose(1, 2)
+        # numpy has no bfloat16 and the kernel is compiled for int8/float32 stores
+        if doc_emb.dtype not in (torch.int8, torch.float32):
+            doc_emb = doc_emb.float()
+        scale = doc_scale if doc_scale is not None else torch.ones(n_docs, n_patches)
+        lengths = doc_mask.sum(dim=-1) if doc_mask is not None else torch.full((n_docs,), n_patches)
+        out = np.empty((query_emb.shape[0], doc_emb.shape[0]), dtype=np.float32)
+        _maxsim_numba(
+            query_emb.float().contiguous().numpy(),
+            doc_emb.contiguous().numpy(),
+            scale.float().contiguous().numpy(),
+            lengths.to(torch.int64).numpy(),
+            out,
+        )
+        return torch.from_numpy(out)
+
+    # Score in FP32 regardless of the embedding dtype; the store itself is only widened a
+    # block at a time
+    compute_dtype = torch.float32
+    query_emb = query_emb.to(compute_dtype).to(doc_emb.device)
+    n_queries, n_q_tokens, _ = query_emb.shape
+    queries = query_emb.reshape(-1, dim)  # (n_queries * n_q_tokens, dim)
+
+    scores = torch.empty(n_queries, n_docs, dtype=torch.float32, device=doc_emb.device)
+
+    for start in range(0, n_docs, block_size):
+        end = min(start + block_size, n_docs)
+        n_block = end - start
+        dots = _score_buf("dots", (n_block, n_queries * n_q_tokens, n_patches), compute_dtype, doc_emb.device)
+        token_max = _score_buf("token_max", (n_block, n_queries, n_q_tokens), compute_dtype, doc_emb.device)
+        block_scores = _score_buf("block_scores", (n_block, n_queries), torch.float32, doc_emb.device)
+
+        # Dot product between every query token and every patch of this doc block
+        # as one batched matmul: (block, n_queries * n_q_tokens, n_patches)
+        # Only the current block is brought to (block, dim, n_patches); a row-major store
+        # is transposed here rather than copying the whole corpus up front
+        docs = doc_emb[start:end].to(compute_dtype)
+        if not patch_major:
+            docs = docs.transpose(1, 2)
+        torch.bmm(queries.unsqueeze(0).expand(n_block, -1, -1), docs, out=dots)
+        dots_4d = dots.view(n_block, n_queries, n_q_tokens, n_patches)
+        if doc_scale is not None:
+            dots_4d.mul_(doc_scale[start:end, None, None, :].to(compute_dtype))
+        if doc_mask is not None:
+            dots_4d.masked_fill_(~doc_mask[start:end, None, None, :].to(doc_emb.device), float("-inf"))
+
+        # For each query token → max similarity to any patch in that doc (a stride-1
+        # reduction), then sum over query tokens → (block, n_queries)
+        torch.amax(dots_4d, dim=-1, out=token_max)
+        torch.sum(token_max, dim=-1, out=block_scores)
+        scores[:, start:end] = block_scores.T
 
     return scores
 
 
 def encode_image_to_base64(image_path: str) -> str:
+    # mmap the file so it is never copied into a Python bytes object, and use
+    # b2a_base64 directly (no line breaks, thinner than base64.b64encode)
     with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
+        encoded_string = ""
+        if os.fstat(image_file.fileno()).st_size:  # mmap rejects empty files
+            with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                encoded_string = binascii.b2a_base64(mm, newline=False).decode("ascii")
+
     # Determine mime type based on extension
-    ext = os.path.splitext(image_path)[1].lower()
-    mime_type = "image/jpeg" if ext in [".jpg", ".jpeg"] else "image/png"
+    mime_type = _MIME_TYPES.get(os.path.splitext(image_path)[1].lower(), "image/png")
     return f"data:{mime_type};base64,{encoded_string}"
 
 
-def get_embeddings(inputs: List[str], model: str = "qnguyen3/colqwen2.5-v0.2-mlx") -> torch.Tensor:
+def get_embeddings(inputs: List[str], model: str = "qnguyen3/colqwen2.5-v0.2-mlx") -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Embed *inputs* in one request. The server returns each input's own vectors only, so
+    they are right-padded into one (n, max_len, dim) tensor plus a (n, max_len) bool mask
+    that is False on the padding.
+    """
     url = "http://localhost:8888/v1/embeddings"
     payload = {"input": inputs, "model": model}
-    response = requests.post(url, json=payload)
+    response = SESSION.post(url, json=payload)
     if response.status_code != 200:
         print(f"Error: {response.text}")
         response.raise_for_status()
@@ -61,8 +224,11 @@ def get_embeddings(inputs: List[str], model: str = "qnguyen3/colqwen2.5-v0.2-mlx
     data = response.json()["data"]
     # Sort by index to ensure order
     data.sort(key=lambda x: x["index"])
-    embeddings = [x["embedding"] for x in data]
-    return torch.tensor(embeddings)
+    embeddings = [torch.tensor(x["embedding"], dtype=torch.float32) for x in data]
+    lengths = torch.tensor([e.shape[0] for e in embeddings])
+    padded = torch.nn.utils.rnn.pad_sequence(embeddings, batch_first=True)
+    mask = torch.arange(padded.shape[1])[None, :] < lengths[:, None]
+    return padded, mask
 
 
 def main():
@@ -90,23 +256,27 @@ def main():
 
     # 1. Get Query Embedding
     print(f"Encoding query: {query}")
-    query_emb = get_embeddings([query])  # Shape (1, tokens, dim)
+    query_emb, _ = get_embeddings([query])  # Shape (1, tokens, dim); a single input has no padding
 
-    # 2. Get Image Embeddings and calculate scores one by one
-    print("\nEncoding images and calculating scores individually...")
-    score_list = []
+    # 2. Get all Image Embeddings in one batched request and score them together
+    print("\nEncoding images and calculating scores in one batch...")
+    all_b64 = [encode_image_to_base64(p) for p in image_paths]
+    # Images have different patch counts: (n_images, max_patches, dim) plus a validity mask
+    doc_embs, doc_mask = get_embeddings(all_b64)
 
-    for path in image_paths:
-        print(f"Processing {os.path.basename(path)}...", end="", flush=True)
-        img_b64 = encode_image_to_base64(path)
-        doc_emb = get_embeddings([img_b64])  # Shape (1, patches, dim)
+    # Keep the doc store as int8 + per-patch scales (4× smaller than float32),
+    # laid out patch-major so scoring reads it without a transpose
+    doc_q, doc_scale = quantize_int8(doc_embs)
+    doc_q = to_patch_major(doc_q)
 
-        # Calculate Score for this pair
-        score = late_interaction_score(query_emb, doc_emb)
-        final_score = score.item()
+    scores = late_interaction_score(query_emb, doc_q, doc_scale=doc_scale, patch_major=True, doc_mask=doc_mask)[
+        0
+    ]  # (n_images,)
+    score_list = []
 
-        print(f" Score: {final_score:.4f}")
-        score_list.append((path, final_score))
+    for path, score in zip(image_paths, scores.tolist()):
+        print(f"{os.path.basename(path)} Score: {score:.4f}")
+        score_list.append((path, score))
 
     # Sort by score desc
     score_list.sort(key=lambda x: x[1], reverse=True)
@@ -4,18 +4,41 @@ import concurrent.futures
 import io
 import logging
 import os
+import re
 import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
 from time import monotonic
-from typing import Any, List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import mlx.core as mx
+import numpy as np
 import requests
 from mlx_embeddings.utils import load
 from PIL import Image
 
 logger = logging.getLogger("uvicorn.error")
 
+# Optional libjpeg-turbo decoder (pip install "mlx-embeddings-server[fast-decode]")
+try:
+    from turbojpeg import TJPF_RGB, TurboJPEG
+
+    _TURBOJPEG = TurboJPEG()
+except Exception:  # wheel not installed, or libturbojpeg not found
+    _TURBOJPEG = None
+
+JPEG_MAGIC = b"\xff\xd8"
+
+# Inputs that look like an image reference (URL or data URI); everything else is text.
+IMAGE_INPUT_RE = re.compile(r"^(?:https?://|data:image)")
+
+# Smallest sequence-length bucket; longer inputs round up to the next power of two.
+MIN_SEQ_BUCKET = 64
+
+# Compiled graphs kept per model; the least recently used shape is evicted beyond this.
+MAX_COMPILED_GRAPHS = 64
+
 
 def is_url(string: str) -> bool:
     return string.startswith("http://") or string.startswith("https://")
@@ -25,127 +48,389 @@ def is_base64_image(string: str) -> bool:
     return string.startswith("data:image")
 
 
-def load_image(image_str: str) -> Image.Image:
-    if is_url(image_str):
-        resp = requests.get(image_str, stream=True)
+def to_numpy(arr: mx.array) -> np.ndarray:
+    """Materialise an MLX array as float32 NumPy, skipping the per-float Python objects of ``tolist()``."""
+    return np.asarray(arr.astype(mx.float32))
+
+
+def maxsim_scores(query_emb: np.ndarray, doc_embs: List[np.ndarray]) -> np.ndarray:
+    """
+    Late-interaction (MaxSim) score of one query against each document, computed in MLX.
+
+    Multi-vector embeddings are (tokens, dim); single-vector ones (dim,) are treated as
+    one token, which reduces MaxSim to a dot product. Documents are padded to the longest
+    one and scored in a single batched matmul, with padded patches masked out.
+    """
+    query = mx.array(np.atleast_2d(query_emb))  # (n_q_tokens, dim)
+    docs = [np.atleast_2d(d) for d in doc_embs]
+    lengths = mx.array([d.shape[0] for d in docs])
+    padded = np.zeros((len(docs), max(d.shape[0] for d in docs), query.shape[-1]), dtype=np.float32)
+    for i, d in enumerate(docs):
+        padded[i, : d.shape[0]] = d
+
+    # (n_docs, n_q_tokens, n_patches)
+    sims = query[None] @ mx.array(padded).transpose(0, 2, 1)
+    valid = mx.arange(padded.shape[1])[None, :] < lengths[:, None]
+    sims = mx.where(valid[:, None, :], sims, -mx.inf)
+    scores = sims.max(axis=-1).sum(axis=-1)
+    return to_numpy(scores)
+
+
+def strip_padding(embeds: np.ndarray, attention_mask: Optional[np.ndarray]) -> List[np.ndarray]:
+    """Split a padded (B, L, dim) batch into per-input arrays holding only the unmasked positions."""
+    if attention_mask is None:
+        return list(embeds)
+    mask = np.asarray(attention_mask).astype(bool)
+    return [embed[row[: embed.shape[0]]] for embed, row in zip(embeds, mask)]
+
+
+def bucket_length(length: int, minimum: int = MIN_SEQ_BUCKET) -> int:
+    """Round *length* up to a power-of-two bucket so compiled graphs are reused across requests."""
+    bucket = minimum
+    while bucket < length:
+        bucket *= 2
+    return bucket
+
+
+def decode_image(data: bytes) -> Image.Image:
+    """Decode image bytes to RGB, using libjpeg-turbo for JPEGs when it is available."""
+    if _TURBOJPEG is not None and data[:2] == JPEG_MAGIC:
+        try:
+            return Image.fromarray(_TURBOJPEG.decode(data, pixel_format=TJPF_RGB))
+        except Exception as e:
+            logger.debug(f"TurboJPEG decode failed, falling back to PIL: {e}")
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+
+def load_image(image_str: Union[str, os.PathLike]) -> Image.Image:
+    if isinstance(image_str, os.PathLike):
+        # Local file, only passed in by the API when EMBEDDINGS_ALLOW_LOCAL_PATHS is set
+        with open(image_str, "rb") as f:
+            return decode_image(f.read())
+    elif is_url(image_str):
+        resp = requests.get(image_str)
         resp.raise_for_status()
-        return Image.open(resp.raw).convert("RGB")
+        return decode_image(resp.content)
     elif is_base64_image(image_str):
         try:
             header, encoded = image_str.split(",", 1)
             data = base64.b64decode(encoded)
-            return Image.open(io.BytesIO(data)).convert("RGB")
+            return decode_image(data)
         except Exception as e:
             raise ValueError(f"Invalid base64 image: {e}")
     else:
         try:
             data = base64.b64decode(image_str)
-            return Image.open(io.BytesIO(data)).convert("RGB")
+            return decode_image(data)
         except Exception as e:
             raise ValueError(f"Could not decode image: {e}")
 
 
+@dataclass
+class PreparedBatch:
+    """CPU-side processor outputs for one batch, ready for the MLX forward pass."""
+
+    n_inputs: int
+    text_indices: List[int]
+    image_indices: List[int]
+    text: Any = None  # processor output for the text inputs, if any
+    image: Any = None  # processor output for the image inputs, if any
+
+
 class BaseModel(ABC):
     def __init__(self, model: Any, processor: Any):
         self.model = model
         self.processor = processor
+        # One compiled graph per (forward name, input shapes), least recently used first
+        self._compiled: OrderedDict[Tuple[str, Tuple[Tuple[int, ...], ...]], Callable] = OrderedDict()
 
     @abstractmethod
-    def get_embeddings(self, inputs: List[str]) -> List[Any]:
-        pass
+    def preprocess(self, inputs: List[str]) -> PreparedBatch:
+        """Load images and run the processor. CPU only — must not touch MLX."""
+
+    @abstractmethod
+    def forward(self, batch: PreparedBatch) -> List[Any]:
+        """Run the MLX forward pass on a prepared batch."""
 
-    def _prepare_inputs(self, inputs: List[str]) -> Tuple[List[int], List[str], List[int], List[Image.Image]]:
-        text_indices = []
-        text_inputs_list = []
+    def get_embeddings(self, inputs: List[str]) -> List[Any]:
+        return self.forward(self.preprocess(inputs))
+
+    def _run_compiled(self, name: str, fn: Callable[..., mx.array], *args: mx.array) -> mx.array:
+        """
+        Run *fn* through ``mx.compile``, reusing the compiled graph for repeated input shapes.
+
+        Forwards that cannot be traced (e.g. they synchronise with the host) fall back to
+        eager execution for that shape, and the fallback is cached so tracing is not retried.
+        At most ``MAX_COMPILED_GRAPHS`` shapes are kept; callers bucket their inputs so
+        that only a handful are ever needed.
+        """
+        key = (name, tuple(tuple(a.shape) for a in args))
+        compiled = self._compiled.get(key)
+        if compiled is not None:
+            self._compiled.move_to_end(key)
+            return compiled(*args)
+
+        compiled = mx.compile(fn)
+        try:
+            out = compiled(*args)
+        except Exception as e:
+            logger.warning(f"mx.compile failed for {name} {key[1]}, running eagerly: {e}")
+            compiled = fn
+            out = fn(*args)
+        self._compiled[key] = compiled
+        if len(self._compiled) > MAX_COMPILED_GRAPHS:
+            self._compiled.popitem(last=False)
+        return out
+
+    @property
+    def _pad_token_id(self) -> int:
+        return getattr(getattr(self.processor, "tokenizer", self.processor), "pad_token_id", None) or 0
+
+    @staticmethod
+    def _pad_batch(arr: mx.array, pad_value: Union[int, float] = 0) -> mx.array:
+        """Pad the batch axis of *arr* with filler rows up to the next power of two."""
+        batch_size = arr.shape[0]
+        pad = bucket_length(batch_size, minimum=1) - batch_size
+        if pad == 0:
+            return arr
+        return mx.pad(arr, [(0, pad)] + [(0, 0)] * (arr.ndim - 1), constant_values=pad_value)
+
+    def _pad_input_ids(self, input_ids: mx.array) -> mx.array:
+        """Right-pad *input_ids* to the sequence-length bucket and fill rows up to the batch bucket."""
+        seq_len = input_ids.shape[1]
+        pad = bucket_length(seq_len) - seq_len
+        if pad:
+            input_ids = mx.pad(input_ids, [(0, 0), (0, pad)], constant_values=self._pad_token_id)
+        return self._pad_batch(input_ids, self._pad_token_id)
+
+    def _prepare_inputs(
+        self, inputs: List[Union[str, os.PathLike]]
+    ) -> Tuple[List[int], List[str], List[int], List[Image.Image]]:
         image_indices = []
         image_inputs_list = []
 
-        for idx, inp in enumerate(inputs):
-            is_img = False
-            if is_url(inp) or is_base64_image(inp):
-                try:
-                    img = load_image(inp)
-                    image_indices.append(idx)
-                    image_inputs_list.append(img)
-                    is_img = True
-                    logger.info(f"Input {idx} detected as an image.")
-                except Exception as e:
-                    logger.warning(f"Failed to load image input {idx}: {e}")
-
-            if not is_img:
-                text_indices.append(idx)
-                text_inputs_list.append(inp)
+        # One anchored regex match per input instead of two startswith() calls,
+        # and only the candidates go through the (exception-raising) image loader.
+        candidates = [
+            idx for idx, inp in enumerate(inputs) if isinstance(inp, os.PathLike) or IMAGE_INPUT_RE.match(inp)
+        ]
+        for idx in candidates:
+            try:
+                image_inputs_list.append(load_image(inputs[idx]))
+                image_indices.append(idx)
+                logger.info(f"Input {idx} detected as an image.")
+            except Exception as e:
+                if isinstance(inputs[idx], os.PathLike):
+                    # A path is never meant as text, so there is nothing to fall back to
+                    raise ValueError(f"Could not load image file {inputs[idx]}: {e}")
+                logger.warning(f"Failed to load image input {idx}: {e}")
+
+        # Anything that is not a successfully loaded image is embedded as text
+        loaded = set(image_indices)
+        text_indices = [idx for idx in range(len(inputs)) if idx not in loaded]
+        text_inputs_list = [inputs[idx] for idx in text_indices]
 
         return text_indices, text_inputs_list, image_indices, image_inputs_list
 
 
 class ColQwenModel(BaseModel):
-    def get_embeddings(self, inputs: List[str]) -> List[Any]:
-        results: List[Any] = [None] * len(inputs)
+    # Image prompt around the <|image_pad|> placeholder, which the processor expands
+    # to one token per merged vision patch.
+    IMAGE_PROMPT_PREFIX = "<|vision_start|>"
+    IMAGE_PROMPT_SUFFIX = "<|vision_end|>Describe this image."
+
+    def __init__(self, model: Any, processor: Any):
+        super().__init__(model, processor)
+        # The language model runs without an attention mask (causal only), so padding
+        # must come after the real tokens to leave their embeddings untouched.
+        tokenizer = getattr(processor, "tokenizer", None)
+        if tokenizer is not None:
+            tokenizer.padding_side = "right"
+        self._image_prompt = self._tokenize_image_prompt()
+
+    def _tokenize_image_prompt(self) -> Optional[Tuple[List[int], List[int], int]]:
+        """Tokenise the constant image prompt once: (prefix ids, suffix ids, image_pad id)."""
+        tokenizer = getattr(self.processor, "tokenizer", None)
+        if tokenizer is None or getattr(self.processor, "image_processor", None) is None:
+            return None
+        try:
+            prefix = tokenizer(self.IMAGE_PROMPT_PREFIX, add_special_tokens=False).input_ids
+            suffix = tokenizer(self.IMAGE_PROMPT_SUFFIX, add_special_tokens=False).input_ids
+            image_pad_id = tokenizer.convert_tokens_to_ids("<|image_pad|>")
+        except Exception as e:
+            logger.warning(f"Could not pre-tokenise the image prompt, using the full processor: {e}")
+            return None
+        return prefix, suffix, image_pad_id
+
+    def _process_images(self, image_inputs: List[Image.Image]) -> Any:
+        """
+        Run only the image processor and assemble input_ids from the cached prompt tokens.
+
+        Each row is prefix + <|image_pad|> × (t·h·w / merge_size²) + suffix, right-padded,
+        with its attention mask — the same ids processor(text=prompts, images=...) builds,
+        without re-tokenising the prompt for every image.
+        """
+        if self._image_prompt is None:
+            text_prompt = self.IMAGE_PROMPT_PREFIX + "<|image_pad|>" + self.IMAGE_PROMPT_SUFFIX
+            prompts = [text_prompt] * len(image_inputs)
+            return self.processor(text=prompts, images=image_inputs, padding=True, return_tensors="np")
+
+        prefix, suffix, image_pad_id = self._image_prompt
+        tokenizer = self.processor.tokenizer
+        image_processor = self.processor.image_processor
+        proc = image_processor(images=image_inputs, return_tensors="np")
+
+        merge_length = image_processor.merge_size**2
+        rows = [prefix + [image_pad_id] * int(n) + suffix for n in proc["image_grid_thw"].prod(axis=-1) // merge_length]
+        max_len = max(len(row) for row in rows)
+        pad_id = tokenizer.pad_token_id or 0
+        input_ids = np.full((len(rows), max_len), pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(rows), max_len), dtype=np.int64)
+        for i, row in enumerate(rows):
+            input_ids[i, : len(row)] = row
+            attention_mask[i, : len(row)] = 1
+        proc["input_ids"] = input_ids
+        proc["attention_mask"] = attention_mask
+        return proc
+
+    def _text_forward(self, input_ids: mx.array) -> mx.array:
+        return self.model(input_ids=input_ids).text_embeds
+
+    def preprocess(self, inputs: List[str]) -> PreparedBatch:
         text_indices, text_inputs, image_indices, image_inputs = self._prepare_inputs(inputs)
+        batch = PreparedBatch(len(inputs), text_indices, image_indices)
 
-        # Process text
         if text_inputs:
-            text_inputs_proc = self.processor(text=text_inputs, padding=True, return_tensors="pt")
-            text_input_ids = mx.array(text_inputs_proc.input_ids)
-
-            proc_out = self.model(input_ids=text_input_ids)
-            embeds_list = proc_out.text_embeds.tolist()
-            mx.eval()  # ensure Metal command buffers are fully retired
+            batch.text = self.processor(text=text_inputs, padding=True, return_tensors="np")
 
-            for i, embed in zip(text_indices, embeds_list):
-                results[i] = embed
-
-        # Process images
         if image_inputs:
-            text_prompt = "<|vision_start|><|image_pad|><|vision_end|>Describe this image."
-            prompts = [text_prompt] * len(image_inputs)
+            batch.image = self._process_images(image_inputs)
 
-            image_inputs_proc = self.processor(text=prompts, images=image_inputs, padding=True, return_tensors="pt")
+        return batch
 
-            image_input_ids = mx.array(image_inputs_proc.input_ids)
-            pixel_values = mx.array(image_inputs_proc.pixel_values)
-            image_grid_thw = mx.array(image_inputs_proc.image_grid_thw)
+    def forward(self, batch: PreparedBatch) -> List[Any]:
+        results: List[Any] = [None] * batch.n_inputs
 
-            proc_out = self.model(input_ids=image_input_ids, pixel_values=pixel_values, image_grid_thw=image_grid_thw)
-
-            embeds_list = proc_out.image_embeds.tolist()
+        # Process text
+        if batch.text is not None:
+            text_input_ids = mx.array(batch.text.input_ids)
+            batch_size, seq_len = text_input_ids.shape
+
+            # Attention is causal and rows are independent, so padding to the bucket
+            # leaves the real positions untouched; the filler is sliced off again.
+            text_embeds = self._run_compiled("text", self._text_forward, self._pad_input_ids(text_input_ids))
+            embeds = to_numpy(text_embeds[:batch_size, :seq_len])
             mx.eval()  # ensure Metal command buffers are fully retired
 
-            for i, embed in zip(image_indices, embeds_list):
+            # Drop pad positions so an input's embedding does not depend on what it was batched with
+            for i, embed in zip(batch.text_indices, strip_padding(embeds, batch.text.get("attention_mask"))):
                 results[i] = embed
 
+        # Process images, one forward per patch grid: the vision merge stacks the
+        # per-image features, which only works when every image has the same grid.
+        if batch.image is not None:
+            for rows, group in self._split_by_grid(batch.image):
+                # Not compiled: the vision merge reads image_grid_thw back on the host.
+                proc_out = self.model(
+                    input_ids=mx.array(group["input_ids"]),
+                    pixel_values=mx.array(group["pixel_values"]),
+                    image_grid_thw=mx.array(group["image_grid_thw"]),
+                )
+
+                embeds = to_numpy(proc_out.image_embeds)
+                mx.eval()  # ensure Metal command buffers are fully retired
+
+                for row, embed in zip(rows, strip_padding(embeds, group["attention_mask"])):
+                    results[batch.image_indices[row]] = embed
+
         return results
 
+    @staticmethod
+    def _split_by_grid(proc: Any) -> List[Tuple[List[int], Dict[str, np.ndarray]]]:
+        """
+        Split processor output for several images into groups that share an image_grid_thw.
+
+        Returns (row positions, inputs) per group. pixel_values holds every image's patches
+        back to back, so each group takes its images' slices; input_ids and attention_mask
+        are cut down to the group's own longest row.
+        """
+        grids = np.asarray(proc["image_grid_thw"])
+        input_ids = np.asarray(proc["input_ids"])
+        pixel_values = np.asarray(proc["pixel_values"])
+        attention_mask = proc.get("attention_mask")
+        attention_mask = np.ones_like(input_ids) if attention_mask is None else np.asarray(attention_mask)
+
+        ends = np.cumsum(grids.prod(axis=-1))
+        starts = ends - grids.prod(axis=-1)
+        rows_by_grid: Dict[Tuple[int, ...], List[int]] = {}
+        for row, grid in enumerate(grids):
+            rows_by_grid.setdefault(tuple(int(x) for x in grid), []).append(row)
+
+        groups = []
+        for rows in rows_by_grid.values():
+            length = int(attention_mask[rows].sum(axis=-1).max())
+            groups.append(
+                (
+                    rows,
+                    {
+                        "input_ids": input_ids[rows, :length],
+                        "attention_mask": attention_mask[rows, :length],
+                        "pixel_values": np.concatenate([pixel_values[starts[r] : ends[r]] for r in rows]),
+                        "image_grid_thw": grids[rows],
+                    },
+                )
+            )
+        return groups
+
 
 class SigLIPModel(BaseModel):
-    def get_embeddings(self, inputs: List[str]) -> List[Any]:
-        results: List[Any] = [None] * len(inputs)
+    def _text_forward(self, input_ids: mx.array) -> mx.array:
+        return self.model.get_text_features(input_ids=input_ids)
+
+    def _image_forward(self, pixel_values: mx.array) -> mx.array:
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+    def preprocess(self, inputs: List[str]) -> PreparedBatch:
         text_indices, text_inputs, image_indices, image_inputs = self._prepare_inputs(inputs)
-        # Process text
+        batch = PreparedBatch(len(inputs), text_indices, image_indices)
+
         if text_inputs:
-            text_inputs_proc = self.processor(text=text_inputs, padding="max_length", return_tensors="pt")
-            text_input_ids = mx.array(text_inputs_proc.input_ids)
+            batch.text = self.processor(text=text_inputs, padding="max_length", return_tensors="np")
+
+        if image_inputs:
+            batch.image = self.processor(images=image_inputs, padding="max_length", return_tensors="np")
+
+        return batch
+
+    def forward(self, batch: PreparedBatch) -> List[Any]:
+        results: List[Any] = [None] * batch.n_inputs
 
-            # Standard MLX model usage for embeddings
-            proc_out = self.model.get_text_features(input_ids=text_input_ids)
-            embeds_list = proc_out.tolist()
+        # Process text
+        if batch.text is not None:
+            text_input_ids = mx.array(batch.text.input_ids)
+
+            # Standard MLX model usage for embeddings; max_length padding fixes the sequence
+            # length and filler rows round the batch up to its bucket
+            batch_size = text_input_ids.shape[0]
+            padded = self._pad_batch(text_input_ids, self._pad_token_id)
+            proc_out = self._run_compiled("text", self._text_forward, padded)
+            embeds = to_numpy(proc_out[:batch_size])
             mx.eval()  # ensure Metal command buffers are fully retired
 
-            for i, embed in zip(text_indices, embeds_list):
+            for i, embed in zip(batch.text_indices, embeds):
                 results[i] = embed
 
         # Process images
-        if image_inputs:
-            image_inputs_proc = self.processor(images=image_inputs, padding="max_length", return_tensors="pt")
+        if batch.image is not None:
             # SigLIP expects NHWC format (Batch, Height, Width, Channels)
-            pixel_values = mx.array(image_inputs_proc.pixel_values).transpose(0, 2, 3, 1).astype(mx.float32)
+            pixel_values = mx.array(batch.image.pixel_values).transpose(0, 2, 3, 1).astype(mx.float32)
 
-            proc_out = self.model.get_image_features(pixel_values=pixel_values)
-            embeds_list = proc_out.tolist()
+            batch_size = pixel_values.shape[0]
+            proc_out = self._run_compiled("image", self._image_forward, self._pad_batch(pixel_values))
+            embeds = to_numpy(proc_out[:batch_size])
             mx.eval()  # ensure Metal command buffers are fully retired
 
-            for i, embed in zip(image_indices, embeds_list):
+            for i, embed in zip(batch.image_indices, embeds):
                 results[i] = embed
 
         return results
@@ -159,13 +444,26 @@ class BatchingEngine:
     asyncio task drains the queue, merges inputs from multiple requests into
     one batch, calls the underlying model once per drain cycle, then resolves
     each Future with its slice of the results.
+
+    Each batch runs in two stages: CPU preprocessing (image decode, tokenisation)
+    on a separate thread, then the MLX forward on the inference thread. The drain
+    loop does not wait for the forward, so batch N+1 is preprocessed while batch N
+    is still running on the GPU. At most ``max_inflight`` batches are in flight.
     """
 
-    def __init__(self, engine: "BaseModel", max_batch_size: int = 64, max_wait_ms: float = 20.0):
+    def __init__(self, engine: "BaseModel", max_batch_size: int = 64, max_wait_ms: float = 20.0, max_inflight: int = 2):
         self._engine = engine
         self._max_batch_size = max_batch_size
         self._max_wait_ms = max_wait_ms
+        self._max_inflight = max_inflight
         self._queue: asyncio.Queue = None  # initialised in start()
+        self._inflight: asyncio.Semaphore = None  # initialised in start()
+        self._forward_tasks: set = set()
+        # Preprocessing is CPU-only and never touches MLX, so it can run
+        # off the inference thread and overlap with the previous forward.
+        self._preprocess_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="mlx-preprocess"
+        )
         # Pin all Metal / MLX work to a single OS thread to prevent
         # cross-thread command-buffer conflicts that cause SIGABRT.
         self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="mlx-inference")
@@ -173,16 +471,19 @@ class BatchingEngine:
     async def start(self) -> None:
         """Run the drain loop. Launch this as an asyncio.Task."""
         self._queue = asyncio.Queue()
+        self._inflight = asyncio.Semaphore(self._max_inflight)
         logger.info(f"Batching engine started (max_batch_size={self._max_batch_size}, max_wait_ms={self._max_wait_ms})")
         try:
             while True:
                 await self._drain()
         except asyncio.CancelledError:
+            for task in self._forward_tasks:
+                task.cancel()
             logger.info("Batching engine stopped.")
             raise
 
     async def _drain(self) -> None:
-        """Wait for the first request, collect stragglers, run one inference call."""
+        """Wait for the first request, collect stragglers, preprocess and dispatch one batch."""
         # Block until at least one request arrives
         first_inputs, first_future = await self._queue.get()
 
@@ -214,21 +515,44 @@ class BatchingEngine:
             waiters.append((fut, cursor, cursor + len(inputs)))
             cursor += len(inputs)
 
+        loop = asyncio.get_running_loop()
+        await self._inflight.acquire()
+        try:
+            batch = await loop.run_in_executor(self._preprocess_executor, self._engine.preprocess, batch_inputs)
+        except Exception as exc:
+            self._inflight.release()
+            self._fail(waiters, exc)
+            return
+
+        # Hand the forward off without awaiting it so the next batch can be
+        # collected and preprocessed in the meantime.
+        task = asyncio.create_task(self._forward(batch, waiters))
+        self._forward_tasks.add(task)
+        task.add_done_callback(self._forward_tasks.discard)
+
+    async def _forward(self, batch: PreparedBatch, waiters: List[Tuple[asyncio.Future, int, int]]) -> None:
+        """Run one prepared batch on the inference thread and resolve its waiters."""
         # Run inference on a dedicated thread — Metal serialises anyway, and
         # keeping the same OS thread avoids MTLCommandBuffer state conflicts.
         loop = asyncio.get_running_loop()
         try:
-            results = await loop.run_in_executor(self._executor, self._engine.get_embeddings, batch_inputs)
+            results = await loop.run_in_executor(self._executor, self._engine.forward, batch)
         except Exception as exc:
-            for fut, _, _ in waiters:
-                if not fut.done():
-                    fut.set_exception(exc)
+            self._fail(waiters, exc)
             return
+        finally:
+            self._inflight.release()
 
         for fut, s, e in waiters:
             if not fut.done():
                 fut.set_result(results[s:e])
 
+    @staticmethod
+    def _fail(waiters: List[Tuple[asyncio.Future, int, int]], exc: Exception) -> None:
+        for fut, _, _ in waiters:
+            if not fut.done():
+                fut.set_exception(exc)
+
     async def embed(self, inputs: List[str]) -> List[Any]:
         """Enqueue *inputs* and await their embeddings."""
         if self._queue is None:
@@ -238,6 +562,36 @@ class BatchingEngine:
         await self._queue.put((inputs, future))
         return await future
 
+    async def warmup(self) -> None:
+        """
+        Run dummy batches through the model so the first real requests do not pay for
+        kernel compilation and Metal pipeline creation: short text at every batch-size
+        bucket up to ``max_batch_size`` (one compiled graph each), then a single image.
+        Longer sequence buckets are still compiled on first use.
+        """
+        buf = io.BytesIO()
+        Image.new("RGB", (32, 32), color=(255, 255, 255)).save(buf, format="PNG")
+        image_uri = f"data:image/png;base64,{base64.b64encode(buf.getvalue()).decode()}"
+
+        batch_buckets = sorted({bucket_length(n, minimum=1) for n in range(1, self._max_batch_size + 1)})
+        runs = [(f"text x{size}", ["warmup"] * size) for size in batch_buckets] + [("image", [image_uri])]
+
+        loop = asyncio.get_running_loop()
+        for name, inputs in runs:
+            t1 = monotonic()
+            try:
+                await loop.run_in_executor(self._executor, self._engine.get_embeddings, inputs)
+            except Exception as e:
+                logger.warning(f"Warm-up ({name}) failed: {e}")
+                continue
+            logger.info(f"Warm-up ({name}) [COMPLETED in {(monotonic() - t1) * 1000:.2f} ms]")
+
+    async def rerank(self, query: str, documents: List[str]) -> np.ndarray:
+        """Embed *query* with *documents* in one batch and return the MaxSim score of each document."""
+        embeddings = await self.embed([query] + documents)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, maxsim_scores, embeddings[0], embeddings[1:])
+
 
 class ModelManager:
     _instance = None
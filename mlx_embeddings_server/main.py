@@ -1,22 +1,33 @@
 import argparse
 import asyncio
 import copy
+import ipaddress
 import logging
 import os
+import pathlib
 from contextlib import asynccontextmanager
 from time import monotonic
+from typing import List, Optional, Union
 
+import msgpack
+import numpy as np
+import orjson
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from PIL import Image
 
 from mlx_embeddings_server.backend import ModelManager
 from mlx_embeddings_server.schemas import (
-    EmbeddingObject,
     EmbeddingRequest,
     EmbeddingResponse,
+    ImagePathInput,
     ModelListResponse,
     ModelObject,
+    RerankRequest,
+    RerankResponse,
+    RerankResult,
     Usage,
 )
 
@@ -66,6 +77,8 @@ async def lifespan(app: FastAPI):
     await run_in_threadpool(ModelManager.get_instance)
     # Start the batching drain loop as a background task
     task = asyncio.create_task(ModelManager.get_instance().batching_engine.start())
+    # Warm up on the inference thread before accepting traffic
+    await ModelManager.get_instance().batching_engine.warmup()
     try:
         yield
     finally:
@@ -77,6 +90,8 @@ async def lifespan(app: FastAPI):
 
 
 app = FastAPI(title="MLX Embeddings Server", lifespan=lifespan)
+# Float-array JSON compresses well; level 1 keeps the CPU cost negligible
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=1)
 
 
 @app.get("/v1/models", response_model=ModelListResponse)
@@ -109,8 +124,72 @@ async def retrieve_model(model_id: str):
     )
 
 
-@app.post("/v1/embeddings", response_model=EmbeddingResponse)
-async def create_embeddings(request: EmbeddingRequest):
+def is_loopback(host: Optional[str]) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def verify_image_file(path: pathlib.Path) -> None:
+    """Raise if *path* is not an image PIL can read, without decoding the pixels."""
+    with Image.open(path) as image:
+        image.verify()
+
+
+async def resolve_image_paths(
+    inputs: List[Union[str, ImagePathInput]], client_host: Optional[str]
+) -> List[Union[str, pathlib.Path]]:
+    """
+    Turn ``image_path`` inputs into paths the backend reads directly, if the server allows
+    it and the request comes from this machine. Unreadable files are rejected here, before
+    they can fail the whole batch they would be coalesced into.
+    """
+    if not any(isinstance(inp, ImagePathInput) for inp in inputs):
+        return inputs
+    if not os.getenv("EMBEDDINGS_ALLOW_LOCAL_PATHS"):
+        raise HTTPException(status_code=403, detail="Local image paths are disabled on this server.")
+    if not is_loopback(client_host):
+        raise HTTPException(status_code=403, detail="Local image paths are only accepted from loopback clients.")
+
+    resolved = [pathlib.Path(inp.path) if isinstance(inp, ImagePathInput) else inp for inp in inputs]
+    paths = [inp for inp in resolved if isinstance(inp, pathlib.Path)]
+    missing = [str(path) for path in paths if not path.is_file()]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Image file(s) not found: {', '.join(missing)}")
+    for path in paths:
+        try:
+            await run_in_threadpool(verify_image_file, path)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Could not read image file {path}: {e}")
+    return resolved
+
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+
+def pack_embeddings(payload: dict) -> bytes:
+    """
+    msgpack encoding of an embeddings payload, where each embedding is sent as raw
+    little-endian float16 bytes plus its shape instead of a nested list of floats.
+    """
+    data = []
+    for item in payload["data"]:
+        embedding = np.asarray(item["embedding"], dtype="<f2")
+        data.append({**item, "embedding": embedding.tobytes(), "shape": list(embedding.shape), "dtype": "float16"})
+    return msgpack.packb({**payload, "data": data})
+
+
+# EmbeddingResponse only documents the response in the OpenAPI schema; the body
+# itself is written by orjson below and never validated float-by-float.
+@app.post(
+    "/v1/embeddings",
+    response_class=Response,
+    responses={200: {"model": EmbeddingResponse, "content": {MSGPACK_MEDIA_TYPE: {}}}},
+)
+async def create_embeddings(request: EmbeddingRequest, raw_request: Request, accept: Optional[str] = Header(None)):
     loaded_model_id = ModelManager.get_instance().model_id
     if request.model and request.model != loaded_model_id:
         raise HTTPException(
@@ -120,6 +199,7 @@ async def create_embeddings(request: EmbeddingRequest):
     inputs = request.input
     if isinstance(inputs, str):
         inputs = [inputs]
+    inputs = await resolve_image_paths(inputs, raw_request.client.host if raw_request.client else None)
 
     try:
         t1 = monotonic()
@@ -131,11 +211,45 @@ async def create_embeddings(request: EmbeddingRequest):
         logger.exception("Error processing embeddings")
         raise HTTPException(status_code=500, detail=str(e))
 
-    data = []
-    for i, embed in enumerate(embeddings):
-        data.append(EmbeddingObject(index=i, embedding=embed))
+    # Serialise the NumPy embeddings directly with orjson instead of validating
+    # every float through the Pydantic response model.
+    payload = {
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": embed} for i, embed in enumerate(embeddings)],
+        "model": loaded_model_id,
+        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+    }
+    if accept and MSGPACK_MEDIA_TYPE in accept:
+        return Response(pack_embeddings(payload), media_type=MSGPACK_MEDIA_TYPE)
+    return Response(orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/json")
 
-    return EmbeddingResponse(data=data, model=loaded_model_id, usage=Usage(prompt_tokens=0, total_tokens=0))
+
+@app.post("/v1/rerank", response_model=RerankResponse)
+async def rerank(request: RerankRequest):
+    loaded_model_id = ModelManager.get_instance().model_id
+    if request.model and request.model != loaded_model_id:
+        raise HTTPException(
+            status_code=404, detail=f"Model '{request.model}' not found. Loaded model is '{loaded_model_id}'."
+        )
+
+    if not request.documents:
+        raise HTTPException(status_code=400, detail="'documents' must contain at least one document.")
+
+    try:
+        t1 = monotonic()
+        logger.info(f"Reranking {len(request.documents)} documents")
+        scores = np.asarray(await ModelManager.get_instance().batching_engine.rerank(request.query, request.documents))
+        t2 = monotonic()
+        logger.info(f"Reranking {len(request.documents)} documents [COMPLETED in {(t2 - t1) * 1000:.2f} ms]")
+    except Exception as e:
+        logger.exception("Error reranking documents")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Only the (index, score) pairs leave the server, highest score first
+    order = np.argsort(-scores, kind="stable")[: request.top_k]
+    results = [RerankResult(index=int(i), relevance_score=float(scores[i])) for i in order]
+
+    return RerankResponse(results=results, model=loaded_model_id, usage=Usage(prompt_tokens=0, total_tokens=0))
 
 
 @app.get("/health")
@@ -173,11 +287,18 @@ def start():
         default=20.0,
         help="Maximum time in ms to wait for additional requests before dispatching a batch (default: 20)",
     )
+    parser.add_argument(
+        "--allow-local-paths",
+        action="store_true",
+        help="Accept {'type': 'image_path', 'path': ...} inputs from loopback clients (read from the local disk)",
+    )
     args = parser.parse_args()
 
     os.environ["MODEL_ID"] = args.model
     os.environ["BATCH_MAX_SIZE"] = str(args.max_batch_size)
     os.environ["BATCH_MAX_WAIT_MS"] = str(args.max_wait_ms)
+    if args.allow_local_paths:
+        os.environ["EMBEDDINGS_ALLOW_LOCAL_PATHS"] = "1"
 
     log_config = copy.deepcopy(LOG_CONFIG)
     log_config["loggers"]["uvicorn"]["level"] = args.log_level.upper()
@@ -1,16 +1,27 @@
 import time
-from typing import List, Optional, Union
+from typing import List, Literal, Optional, Union
 
 from pydantic import BaseModel, Field
 
 
+class ImagePathInput(BaseModel):
+    type: Literal["image_path"] = "image_path"
+    path: str = Field(..., description="Path of an image file on the server's filesystem.")
+
+
 class EmbeddingRequest(BaseModel):
-    input: Union[str, List[str]] = Field(..., description="The input text(s) or image URL(s) to embed.")
+    input: Union[str, List[Union[str, ImagePathInput]]] = Field(
+        ...,
+        description="The input text(s) or image URL(s) to embed. Local image paths are accepted only when "
+        "the server runs with EMBEDDINGS_ALLOW_LOCAL_PATHS set.",
+    )
     model: Optional[str] = Field(None, description="The model ID.")
     encoding_format: Optional[str] = Field("float", description="Format of the embeddings (float or base64).")
     user: Optional[str] = None
 
 
+# EmbeddingObject and EmbeddingResponse describe the /v1/embeddings output for the OpenAPI
+# schema only; that route serialises NumPy embeddings with orjson instead of instantiating them.
 class EmbeddingObject(BaseModel):
     object: str = "embedding"
     index: int
@@ -30,6 +41,25 @@ class EmbeddingResponse(BaseModel):
     usage: Usage
 
 
+class RerankRequest(BaseModel):
+    query: str = Field(..., description="The query text or image to score the documents against.")
+    documents: List[str] = Field(..., description="The document text(s) or image URL(s) to rank.")
+    model: Optional[str] = Field(None, description="The model ID.")
+    top_k: Optional[int] = Field(None, ge=1, description="Return only the top_k highest-scoring documents.")
+
+
+class RerankResult(BaseModel):
+    index: int
+    relevance_score: float
+
+
+class RerankResponse(BaseModel):
+    object: str = "list"
+    results: List[RerankResult]
+    model: str
+    usage: Usage
+
+
 class ModelObject(BaseModel):
     id: str
     object: str = "model"
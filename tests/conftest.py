@@ -1,10 +1,21 @@
+import os
+import time
+import uuid
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from fastapi.testclient import TestClient
+from qdrant_client import QdrantClient
+from testcontainers.core.docker_client import DockerClient
+from testcontainers.qdrant import QdrantContainer
 
 from mlx_embeddings_server.main import app
 
+# Using the same image tag as in scripts/qdrant-docker.sh
+QDRANT_IMAGE = "qdrant/qdrant:v1.16"
+# Label of the long-lived Qdrant container used when E2E_REUSE_CONTAINER is set
+QDRANT_REUSE_LABEL = "mlx-embeddings-server.e2e"
+
 
 @pytest.fixture
 def mock_manager_instance():
@@ -12,6 +23,7 @@ def mock_manager_instance():
     mock_instance = MagicMock()
     mock_instance.model_id = "colqwen2.5"
     mock_instance.batching_engine.start = AsyncMock()  # returns immediately instead of looping
+    mock_instance.batching_engine.warmup = AsyncMock()  # skip the dummy forward passes
     mock_instance.batching_engine.embed = AsyncMock(return_value=[])  # overridden per test
     return mock_instance
 
@@ -26,12 +38,103 @@ def client(mock_manager_instance):
             yield c
 
 
+@pytest.fixture
+def loopback_client(mock_manager_instance):
+    """Like ``client``, but requests appear to come from 127.0.0.1 (needed for image_path inputs)."""
+    with patch("mlx_embeddings_server.main.ModelManager") as MockManager:
+        MockManager.get_instance.return_value = mock_manager_instance
+
+        with TestClient(app, client=("127.0.0.1", 50000)) as c:
+            yield c
+
+
+def _reusable_qdrant_connection(timeout: float = 30.0) -> dict:
+    """
+    Find the labelled Qdrant container left running by an earlier session (starting it if
+    there is none) and wait until it answers.
+    """
+    # testcontainers' client resolves the Docker host the same way get_container_host_ip()
+    # does for the per-session container (DOCKER_HOST, TC_HOST, docker-in-docker gateway)
+    tc_docker = DockerClient()
+    docker_client = tc_docker.client
+    running = docker_client.containers.list(filters={"label": f"{QDRANT_REUSE_LABEL}=qdrant"})
+    if running:
+        container = running[0]
+    else:
+        container = docker_client.containers.run(
+            QDRANT_IMAGE,
+            detach=True,
+            labels={QDRANT_REUSE_LABEL: "qdrant"},
+            ports={"6333/tcp": None, "6334/tcp": None},
+        )
+    container.reload()
+
+    def host_port(port: int) -> int:
+        return int(container.ports[f"{port}/tcp"][0]["HostPort"])
+
+    connection = {"host": tc_docker.host(), "port": host_port(6333), "grpc_port": host_port(6334), "prefer_grpc": True}
+    probe = QdrantClient(**connection)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            probe.get_collections()
+            break
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+    probe.close()
+    return connection
+
+
+@pytest.fixture(scope="session")
+def qdrant_connection():
+    """
+    Connection kwargs (gRPC preferred) for the Qdrant shared by every e2e test in the session.
+
+    By default a fresh container lives for the session. With E2E_REUSE_CONTAINER set, the
+    container is left running after the session and picked up again by the next one, so
+    local ``--run-e2e`` loops skip the container start; per-test collections keep runs apart.
+    """
+    if os.getenv("E2E_REUSE_CONTAINER"):
+        yield _reusable_qdrant_connection()
+        return
+
+    with QdrantContainer(QDRANT_IMAGE) as qdrant:
+        yield {
+            "host": qdrant.get_container_host_ip(),
+            "port": qdrant.exposed_rest_port,
+            "grpc_port": qdrant.exposed_grpc_port,
+            "prefer_grpc": True,
+        }
+
+
+@pytest.fixture(scope="session")
+def qdrant_client_fixture(qdrant_connection):
+    """Provides a QdrantClient connected to the e2e Qdrant over gRPC."""
+    client = QdrantClient(**qdrant_connection)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def collection_name(qdrant_client_fixture):
+    """A unique collection name per test, dropped again on teardown."""
+    name = f"e2e_{uuid.uuid4().hex}"
+    yield name
+    if qdrant_client_fixture.collection_exists(name):
+        qdrant_client_fixture.delete_collection(name)
+
+
 def pytest_addoption(parser):
     parser.addoption("--run-e2e", action="store_true", default=False, help="run end-to-end integration tests")
 
 
 def pytest_configure(config):
     config.addinivalue_line("markers", "e2e: mark test as end-to-end integration test")
+    if config.getoption("--run-e2e"):
+        # e2e tests hand the in-process server local image paths instead of base64 data URIs
+        os.environ.setdefault("EMBEDDINGS_ALLOW_LOCAL_PATHS", "1")
 
 
 def pytest_collection_modifyitems(config, items):
@@ -1,6 +1,10 @@
+import pathlib
 from unittest.mock import AsyncMock
 
+import msgpack
+import numpy as np
 from fastapi.testclient import TestClient
+from PIL import Image
 
 
 def test_health(client: TestClient):
@@ -58,6 +62,110 @@ def test_create_embedding_batch_text(client: TestClient, mock_manager_instance):
     mock_manager_instance.batching_engine.embed.assert_called_once_with(["Hello", "World"])
 
 
+def test_create_embedding_numpy_output(client: TestClient, mock_manager_instance):
+    """Test that NumPy embeddings from the backend are serialised as nested float lists."""
+    mock_manager_instance.batching_engine.embed = AsyncMock(
+        return_value=[np.array([[0.5, 0.25], [0.125, 1.0]], dtype=np.float32)]
+    )
+
+    response = client.post("/v1/embeddings", json={"input": "numpy"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json()["data"][0]["embedding"] == [[0.5, 0.25], [0.125, 1.0]]
+
+
+def test_create_embedding_image_path(loopback_client: TestClient, mock_manager_instance, tmp_path, monkeypatch):
+    """Test that image_path inputs reach the backend as paths when local paths are allowed."""
+    monkeypatch.setenv("EMBEDDINGS_ALLOW_LOCAL_PATHS", "1")
+    image_file = tmp_path / "image.png"
+    Image.new("RGB", (4, 4)).save(image_file)
+    mock_manager_instance.batching_engine.embed = AsyncMock(return_value=[[[0.1]], [[0.2]]])
+
+    payload = {"input": [{"type": "image_path", "path": str(image_file)}, "text"]}
+    response = loopback_client.post("/v1/embeddings", json=payload)
+
+    assert response.status_code == 200
+    mock_manager_instance.batching_engine.embed.assert_called_once_with([pathlib.Path(image_file), "text"])
+
+
+def test_create_embedding_image_path_disabled(client: TestClient, mock_manager_instance, monkeypatch):
+    """Test that image_path inputs are rejected unless the server allows local paths."""
+    monkeypatch.delenv("EMBEDDINGS_ALLOW_LOCAL_PATHS", raising=False)
+
+    response = client.post("/v1/embeddings", json={"input": [{"type": "image_path", "path": "/etc/hosts"}]})
+
+    assert response.status_code == 403
+    mock_manager_instance.batching_engine.embed.assert_not_called()
+
+
+def test_create_embedding_image_path_missing(loopback_client: TestClient, mock_manager_instance, tmp_path, monkeypatch):
+    """Test that a missing image file is a client error."""
+    monkeypatch.setenv("EMBEDDINGS_ALLOW_LOCAL_PATHS", "1")
+
+    response = loopback_client.post(
+        "/v1/embeddings", json={"input": [{"type": "image_path", "path": str(tmp_path / "nope")}]}
+    )
+
+    assert response.status_code == 400
+    mock_manager_instance.batching_engine.embed.assert_not_called()
+
+
+def test_create_embedding_image_path_unreadable(
+    loopback_client: TestClient, mock_manager_instance, tmp_path, monkeypatch
+):
+    """Test that a file that is not an image is rejected before it can fail a coalesced batch."""
+    monkeypatch.setenv("EMBEDDINGS_ALLOW_LOCAL_PATHS", "1")
+    image_file = tmp_path / "image.png"
+    image_file.write_bytes(b"not an image")
+
+    response = loopback_client.post("/v1/embeddings", json={"input": [{"type": "image_path", "path": str(image_file)}]})
+
+    assert response.status_code == 400
+    mock_manager_instance.batching_engine.embed.assert_not_called()
+
+
+def test_create_embedding_image_path_remote_client(client: TestClient, mock_manager_instance, tmp_path, monkeypatch):
+    """Test that image_path inputs are refused for clients that are not on this machine."""
+    monkeypatch.setenv("EMBEDDINGS_ALLOW_LOCAL_PATHS", "1")
+    image_file = tmp_path / "image.png"
+    Image.new("RGB", (4, 4)).save(image_file)
+
+    response = client.post("/v1/embeddings", json={"input": [{"type": "image_path", "path": str(image_file)}]})
+
+    assert response.status_code == 403
+    mock_manager_instance.batching_engine.embed.assert_not_called()
+
+
+def test_create_embedding_msgpack(client: TestClient, mock_manager_instance):
+    """Test that msgpack clients get float16 embedding bytes plus shape."""
+    embedding = np.array([[0.5, 0.25], [0.125, 1.0]], dtype=np.float32)
+    mock_manager_instance.batching_engine.embed = AsyncMock(return_value=[embedding])
+
+    response = client.post("/v1/embeddings", json={"input": "packed"}, headers={"Accept": "application/x-msgpack"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-msgpack"
+    data = msgpack.unpackb(response.content)
+    assert data["model"] == "colqwen2.5"
+    item = data["data"][0]
+    assert item["index"] == 0
+    decoded = np.frombuffer(item["embedding"], dtype="<f2").reshape(item["shape"])
+    np.testing.assert_array_equal(decoded, embedding)
+
+
+def test_create_embedding_gzip(client: TestClient, mock_manager_instance):
+    """Test that large embedding responses are gzip-compressed for clients that accept it."""
+    embedding = np.full((64, 128), 0.5, dtype=np.float32)
+    mock_manager_instance.batching_engine.embed = AsyncMock(return_value=[embedding])
+
+    response = client.post("/v1/embeddings", json={"input": "big"}, headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["data"][0]["embedding"] == embedding.tolist()
+
+
 def test_create_embedding_validation_error(client: TestClient):
     """Test validation error when input is missing."""
     payload = {"model": "colqwen2.5"}
@@ -108,3 +216,30 @@ def test_retrieve_model(client: TestClient):
     # Test invalid model
     response = client.get("/v1/models/non-existent-model")
     assert response.status_code == 404
+
+
+def test_rerank(client: TestClient, mock_manager_instance):
+    """Test that rerank returns documents ordered by score, truncated to top_k."""
+    mock_manager_instance.batching_engine.rerank = AsyncMock(return_value=[0.1, 0.9, 0.5])
+
+    payload = {"query": "cats", "documents": ["car", "cat photo", "dog"], "model": "colqwen2.5", "top_k": 2}
+    response = client.post("/v1/rerank", json=payload)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["model"] == "colqwen2.5"
+    assert [r["index"] for r in data["results"]] == [1, 2]
+    assert data["results"][0]["relevance_score"] == 0.9
+
+    mock_manager_instance.batching_engine.rerank.assert_called_once_with("cats", ["car", "cat photo", "dog"])
+
+
+def test_rerank_empty_documents(client: TestClient):
+    response = client.post("/v1/rerank", json={"query": "cats", "documents": []})
+    assert response.status_code == 400
+
+
+def test_rerank_model_not_found(client: TestClient):
+    response = client.post("/v1/rerank", json={"query": "cats", "documents": ["cat"], "model": "wrong-model"})
+    assert response.status_code == 404
+    assert "Model 'wrong-model' not found" in response.json()["detail"]
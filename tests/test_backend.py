@@ -0,0 +1,195 @@
+import asyncio
+from types import SimpleNamespace
+
+import mlx.core as mx
+import numpy as np
+import pytest
+from PIL import Image
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast, Qwen2VLImageProcessor
+
+from mlx_embeddings_server import backend
+from mlx_embeddings_server.backend import BatchingEngine, ColQwenModel, PreparedBatch, maxsim_scores
+
+
+class _Encoding(dict):
+    __getattr__ = dict.__getitem__
+
+
+class _StubProcessor:
+    """Character-level 'tokenizer' that pads on the tokenizer's padding side, like HF processors."""
+
+    def __init__(self):
+        self.tokenizer = SimpleNamespace(pad_token_id=0, padding_side="left")
+        self.image_processor = None
+
+    def __call__(self, text, padding=True, return_tensors="np"):
+        rows = [[ord(c) % 250 + 1 for c in t] for t in text]
+        max_len = max(len(r) for r in rows)
+        input_ids = np.zeros((len(rows), max_len), dtype=np.int64)
+        attention_mask = np.zeros_like(input_ids)
+        for i, r in enumerate(rows):
+            sl = slice(max_len - len(r), None) if self.tokenizer.padding_side == "left" else slice(0, len(r))
+            input_ids[i, sl] = r
+            attention_mask[i, sl] = 1
+        return _Encoding(input_ids=input_ids, attention_mask=attention_mask)
+
+
+class _StubModel:
+    """Position-independent token embeddings, so pad tokens produce their own (non-zero) vectors."""
+
+    def __init__(self, dim: int = 8):
+        table = np.random.default_rng(0).standard_normal((256, dim)).astype(np.float32)
+        self.table = mx.array(table / np.linalg.norm(table, axis=-1, keepdims=True))
+
+    def __call__(self, input_ids, **kwargs):
+        return SimpleNamespace(text_embeds=self.table[input_ids])
+
+
+class _StubVisionModel(_StubModel):
+    """
+    Mirrors ColQwen2_5's vision merge: per-image features are sliced by grid and passed to
+    mx.stack, so a batch mixing patch grids fails the same way. Each image's embeddings are
+    scaled by the mean of its own pixel values, so mismatched slices change the output.
+    """
+
+    def __call__(self, input_ids, pixel_values=None, image_grid_thw=None, **kwargs):
+        if pixel_values is None:
+            return super().__call__(input_ids)
+        features, start = [], 0
+        for t, h, w in image_grid_thw.tolist():
+            features.append(pixel_values[start : start + t * h * w])
+            start += t * h * w
+        scale = mx.mean(mx.stack(features), axis=(1, 2))
+        return SimpleNamespace(image_embeds=self.table[input_ids] * (1 + scale[:, None, None]))
+
+
+def _tiny_qwen_tokenizer() -> PreTrainedTokenizerFast:
+    """Word-level tokenizer that knows the ColQwen image prompt and its special tokens."""
+    specials = ["<pad>", "<unk>", "<|vision_start|>", "<|vision_end|>", "<|image_pad|>"]
+    vocab = {tok: i for i, tok in enumerate(specials + ["Describe", "this", "image", "."])}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, pad_token="<pad>", unk_token="<unk>", additional_special_tokens=specials[2:]
+    )
+
+
+def test_maxsim_scores_multi_vector():
+    """MaxSim over ragged multi-vector docs must match a NumPy reference and ignore padding."""
+    rng = np.random.default_rng(0)
+    query = rng.standard_normal((4, 8)).astype(np.float32)
+    docs = [rng.standard_normal((n, 8)).astype(np.float32) for n in (3, 7, 1)]
+
+    scores = maxsim_scores(query, docs)
+
+    expected = [(query @ d.T).max(axis=-1).sum() for d in docs]
+    np.testing.assert_allclose(scores, expected, rtol=1e-5)
+
+
+def test_maxsim_scores_single_vector():
+    """Single-vector embeddings (e.g. SigLIP) reduce to a dot product."""
+    query = np.array([1.0, 0.0], dtype=np.float32)
+    docs = [np.array([0.5, 0.5], dtype=np.float32), np.array([-1.0, 0.0], dtype=np.float32)]
+
+    np.testing.assert_allclose(maxsim_scores(query, docs), [0.5, -1.0])
+
+
+def test_colqwen_text_embeddings_drop_padding():
+    """Each text embedding has one row per real token, however long its batch-mates are."""
+    engine = ColQwenModel(_StubModel(), _StubProcessor())
+
+    hello, hi = engine.get_embeddings(["hello", "hi"])
+
+    assert hello.shape == (5, 8)
+    assert hi.shape == (2, 8)
+    np.testing.assert_allclose(hi, engine.get_embeddings(["hi"])[0], rtol=1e-6)
+
+
+def test_colqwen_image_ids_match_full_processor():
+    """Image ids built from the cached prompt equal what processor(text=prompts, images=...) yields."""
+    processor = SimpleNamespace(tokenizer=_tiny_qwen_tokenizer(), image_processor=Qwen2VLImageProcessor())
+    engine = ColQwenModel(_StubModel(), processor)
+    images = [Image.new("RGB", (64, 96), "red"), Image.new("RGB", (120, 60), "blue")]
+
+    batch = engine._process_images(images)
+
+    # Reference: Qwen2VLProcessor expands <|image_pad|> to one token per merged patch, then
+    # tokenises the prompts together (building the processor itself needs torchvision)
+    reference = processor.image_processor(images=images, return_tensors="np")
+    merge_length = processor.image_processor.merge_size**2
+    prompts = [
+        ColQwenModel.IMAGE_PROMPT_PREFIX + "<|image_pad|>" * int(n) + ColQwenModel.IMAGE_PROMPT_SUFFIX
+        for n in reference["image_grid_thw"].prod(axis=-1) // merge_length
+    ]
+    expected = processor.tokenizer(prompts, padding=True, return_tensors="np")
+
+    assert len(set(expected["attention_mask"].sum(axis=-1))) == 2, "images should need different padding"
+    np.testing.assert_array_equal(batch["input_ids"], expected["input_ids"])
+    np.testing.assert_array_equal(batch["attention_mask"], expected["attention_mask"])
+    np.testing.assert_array_equal(batch["image_grid_thw"], reference["image_grid_thw"])
+    np.testing.assert_allclose(batch["pixel_values"], reference["pixel_values"])
+
+
+def test_colqwen_images_with_different_grids_share_a_batch():
+    """Images with different patch grids are embedded in per-grid groups and match their solo embeddings."""
+    processor = SimpleNamespace(tokenizer=_tiny_qwen_tokenizer(), image_processor=Qwen2VLImageProcessor())
+    engine = ColQwenModel(_StubVisionModel(), processor)
+    images = [
+        Image.new("RGB", (64, 96), "red"),
+        Image.new("RGB", (120, 60), "blue"),
+        Image.new("RGB", (64, 96), "green"),
+    ]
+    batch = PreparedBatch(len(images), [], [0, 1, 2], image=engine._process_images(images))
+
+    embeddings = engine.forward(batch)
+
+    for image, embedding in zip(images, embeddings):
+        solo = engine.forward(PreparedBatch(1, [], [0], image=engine._process_images([image])))[0]
+        np.testing.assert_allclose(embedding, solo, rtol=1e-6)
+    assert embeddings[0].shape != embeddings[1].shape
+
+
+def test_compiled_graphs_bucket_batch_size_and_are_bounded(monkeypatch):
+    """Batch sizes share power-of-two graphs, and the least recently used graph is evicted."""
+    monkeypatch.setattr(backend, "MAX_COMPILED_GRAPHS", 2)
+    engine = ColQwenModel(_StubModel(), _StubProcessor())
+
+    three = engine.get_embeddings(["a", "b", "c"])
+    engine.get_embeddings(["a", "b", "c", "d"])
+    assert list(engine._compiled) == [("text", ((4, 64),))]
+    assert len(three) == 3
+
+    engine.get_embeddings(["a"])
+    engine.get_embeddings(["a" * 100])
+    assert list(engine._compiled) == [("text", ((1, 64),)), ("text", ((1, 128),))]
+
+
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+@pytest.mark.anyio
+async def test_rerank_score_independent_of_batch_mates():
+    """A (query, doc) score must not change when a long document is reranked alongside it."""
+    batching = BatchingEngine(ColQwenModel(_StubModel(), _StubProcessor()), max_wait_ms=0)
+    drain_task = asyncio.create_task(batching.start())
+    await asyncio.sleep(0)
+
+    try:
+        alone = await batching.rerank("hi", ["cats"])
+        with_long = await batching.rerank("hi", ["cats", "a much longer document about several other things"])
+    finally:
+        drain_task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await drain_task
+
+    np.testing.assert_allclose(with_long[0], alone[0], rtol=1e-5)
+
+
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+@pytest.mark.anyio
+async def test_warmup_compiles_every_batch_bucket():
+    """Warm-up traces one text graph per batch-size bucket a drained batch can land in."""
+    engine = ColQwenModel(_StubModel(), _StubProcessor())
+
+    await BatchingEngine(engine, max_batch_size=5).warmup()
+
+    assert [shapes for name, shapes in engine._compiled] == [((n, 64),) for n in (1, 2, 4, 8)]
@@ -1,36 +1,53 @@
-import base64
+import asyncio
+import hashlib
+import importlib.metadata
+import json
+import mmap
 import os
 import pathlib
+import uuid
 
+import httpx
+import msgpack
+import numpy as np
+import orjson
 import pytest
 from fastapi.testclient import TestClient
-from qdrant_client import models
-from testcontainers.qdrant import QdrantContainer
+from qdrant_client import AsyncQdrantClient, models
 
+from mlx_embeddings_server import backend
 from mlx_embeddings_server.main import app
 
+try:
+    # SIMD base64 (AVX2/NEON); falls back to the stdlib when the wheel is missing
+    import pybase64 as _b64
+except ImportError:
+    import base64 as _b64
+
 # Only run if --run-e2e is passed
 pytestmark = pytest.mark.e2e
 
 MODEL_NAME = "qnguyen3/colqwen2.5-v0.2-mlx"
-COLLECTION_NAME = "colqwen_e2e_test"
 VECTOR_SIZE = 128
-
-
-@pytest.fixture(scope="module")
-def qdrant_container():
-    """Starts a Qdrant container for the duration of the module."""
-    # Using the same image tag as in scripts/qdrant-docker.sh
-    with QdrantContainer("qdrant/qdrant:v1.16") as qdrant:
-        yield qdrant
-
-
-@pytest.fixture(scope="module")
-def qdrant_client_fixture(qdrant_container):
-    """Provides a QdrantClient connected to the container."""
-    client = qdrant_container.get_client()
-    yield client
-    client.close()
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[1]
+IMAGES_DIR = REPO_ROOT / "images"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+UPLOAD_BATCH_SIZE = 64
+UPLOAD_PARALLEL = 4
+# Search the int8 vectors, then rescore the oversampled candidates with the original floats
+SEARCH_PARAMS = models.SearchParams(quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0))
+
+
+@pytest.fixture(scope="session")
+def available_images():
+    """Maps file name to path for every image in IMAGES_DIR, listed once per session."""
+    assert IMAGES_DIR.is_dir(), f"Images directory not found at {IMAGES_DIR}"
+    with os.scandir(IMAGES_DIR) as entries:
+        return {
+            e.name: pathlib.Path(e.path)
+            for e in entries
+            if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_EXTENSIONS
+        }
 
 
 @pytest.fixture(scope="module")
@@ -45,72 +62,189 @@ def e2e_client():
 
     ModelManager._instance = None
 
-    with TestClient(app) as c:
+    # image_path inputs are only accepted from loopback clients
+    with TestClient(app, client=("127.0.0.1", 50000)) as c:
+        # The server's lifespan already warmed the text and vision paths before startup finished
+        response = c.get("/health")
+        assert response.status_code == 200, f"Server not healthy: {response.text}"
         yield c
 
 
+# 57 KiB is a multiple of 3, so no chunk but the last produces padding
+B64_CHUNK_SIZE = 57 * 1024
+
+
 def encode_image_to_base64(image_path: str) -> str:
-    """Read an image file and convert it to a base64 data URI."""
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
+    """
+    Memory-map an image file and convert it to a base64 data URI. One open + fstat gives
+    the size, so the output buffer is allocated once up front and filled chunk by chunk.
+    """
     ext = os.path.splitext(image_path)[1].lower()
     mime_type = "image/jpeg" if ext in [".jpg", ".jpeg"] else "image/png"
-    return f"data:{mime_type};base64,{encoded_string}"
+    prefix = f"data:{mime_type};base64,".encode("ascii")
+
+    fd = os.open(image_path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        out = bytearray(len(prefix) + (size + 2) // 3 * 4)
+        out[: len(prefix)] = prefix
+        if size:  # mmap rejects empty files
+            with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                # Slicing the view is zero-copy; each encoded chunk lands in place in `out`
+                pos = len(prefix)
+                for offset in range(0, size, B64_CHUNK_SIZE):
+                    encoded = _b64.b64encode(view[offset : offset + B64_CHUNK_SIZE])
+                    out[pos : pos + len(encoded)] = encoded
+                    pos += len(encoded)
+    finally:
+        os.close(fd)
+    return out.decode("ascii")
+
+
+def unpack_embeddings(response) -> list:
+    """
+    Decode an embeddings response to float32 arrays: float16 bytes + shape per item for
+    application/x-msgpack, nested float lists (parsed straight from the bytes with orjson)
+    for application/json.
+    """
+    content_type = response.headers["content-type"]
+    if content_type == "application/x-msgpack":
+        data = msgpack.unpackb(response.content)["data"]
+        return [
+            np.frombuffer(item["embedding"], dtype="<f2").reshape(item["shape"]).astype(np.float32) for item in data
+        ]
+    assert content_type == "application/json", f"Unexpected content-type: {content_type}"
+    return [np.asarray(item["embedding"], dtype=np.float32) for item in orjson.loads(response.content)["data"]]
 
 
-def test_end_to_end_search(qdrant_client_fixture, e2e_client):
+def batched_embed(client, inputs: list) -> list:
     """
-    E2E Test:
-    1. Create MultiVector collection in Qdrant.
-    2. Index 'cats.jpg' using embeddings from MLX server.
-    3. Query 'What's on the pink bed?'
-    4. Assert 'cats.jpg' is returned with a high score.
+    Embed ``inputs`` in a single request, sending each distinct input once and
+    scattering the results back into input order.
+    """
+    keys = [
+        hashlib.sha256((x if isinstance(x, str) else json.dumps(x, sort_keys=True)).encode()).digest() for x in inputs
+    ]
+    order = {}
+    unique = []
+    for key, x in zip(keys, inputs):
+        if key not in order:
+            order[key] = len(unique)
+            unique.append(x)
+
+    response = client.post(
+        "/v1/embeddings", json={"input": unique, "model": MODEL_NAME}, headers={"Accept": "application/x-msgpack"}
+    )
+    assert response.status_code == 200, f"Embedding API failed: {response.text}"
+    embeddings = unpack_embeddings(response)
+    return [embeddings[order[key]] for key in keys]
+
+
+def embedding_cache_path(request, image_path: pathlib.Path) -> pathlib.Path:
     """
-    # 1. Cleanup Collection if exists
-    if qdrant_client_fixture.collection_exists(COLLECTION_NAME):
-        qdrant_client_fixture.delete_collection(COLLECTION_NAME)
+    Location of the cached embedding for an image. The key covers the model, the code that
+    produces the embedding (backend.py and the installed mlx-embeddings) and the image
+    bytes, so a change to any of them misses instead of returning a stale vector.
+    """
+    digest = hashlib.sha256(MODEL_NAME.encode())
+    digest.update(pathlib.Path(backend.__file__).read_bytes())
+    digest.update(importlib.metadata.version("mlx-embeddings").encode())
+    digest.update(image_path.read_bytes())
+    return request.config.cache.mkdir("embeddings") / f"{digest.hexdigest()}.npy"
+
 
-    # 2. Create Collection
-    qdrant_client_fixture.create_collection(
-        collection_name=COLLECTION_NAME,
+def create_collection(client, collection_name: str):
+    """Create a MaxSim multivector collection with HNSW indexing disabled for bulk ingest."""
+    client.create_collection(
+        collection_name=collection_name,
         vectors_config=models.VectorParams(
             size=VECTOR_SIZE,
             distance=models.Distance.COSINE,
             multivector_config=models.MultiVectorConfig(comparator=models.MultiVectorComparator.MAX_SIM),
+            on_disk=True,
+        ),
+        hnsw_config=models.HnswConfigDiff(m=0),
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0),
+        quantization_config=models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True),
         ),
     )
 
-    # 3. Prepare Data
-    repo_root = pathlib.Path(__file__).parent.parent
-    image_path = repo_root / "images" / "cats.jpg"
-    assert image_path.exists(), f"Image not found at {image_path}"
 
-    # 4. Index Image
-    image_uri = encode_image_to_base64(str(image_path))
+def enable_indexing(client, collection_name: str):
+    """Re-enable HNSW once the upload is done so the graph is built in a single pass."""
+    client.update_collection(
+        collection_name=collection_name,
+        hnsw_config=models.HnswConfigDiff(m=16),
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=20000),
+    )
 
-    # Call Embeddings API to embed image
-    response = e2e_client.post("/v1/embeddings", json={"input": [image_uri], "model": MODEL_NAME})
-    assert response.status_code == 200, f"Embedding API failed: {response.text}"
 
-    data = response.json()["data"][0]
-    embedding = data["embedding"]
+def test_end_to_end_search(
+    request, qdrant_connection, qdrant_client_fixture, collection_name, available_images, e2e_client
+):
+    """
+    E2E Test:
+    1. Create MultiVector collection in Qdrant.
+    2. Index 'cats.jpg' using embeddings from MLX server.
+    3. Query 'What's on the pink bed?'
+    4. Assert 'cats.jpg' is returned with a high score.
+    """
+    # 1-2. Create Collection (unique per test, dropped by the fixture)
+    create_collection(qdrant_client_fixture, collection_name)
 
-    # Upsert to Qdrant
-    qdrant_client_fixture.upsert(
-        collection_name=COLLECTION_NAME,
-        points=[models.PointStruct(id=1, vector=embedding, payload={"filename": "cats.jpg"})],
-    )
+    # 3. Prepare Data
+    assert "cats.jpg" in available_images, f"Image not found in {IMAGES_DIR}"
+    image_path = available_images["cats.jpg"]
 
-    # 5. Search
+    # 4. Embed and index. The image is embedded first (or loaded from the cache when its
+    # key, i.e. model, embedding code and image bytes, is unchanged); its upsert to Qdrant
+    # then runs while the server embeds the query, as the two do not depend on each other.
     query = "What's on the pink bed?"
-    # Call Embeddings API to embed query
-    response_query = e2e_client.post("/v1/embeddings", json={"input": [query], "model": MODEL_NAME})
-    assert response_query.status_code == 200, f"Embedding API query failed: {response_query.text}"
-
-    query_embedding = response_query.json()["data"][0]["embedding"]
+    cache_path = embedding_cache_path(request, image_path)
+
+    async def embed_and_index():
+        aclient = AsyncQdrantClient(**qdrant_connection)
+        try:
+            async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app),
+                base_url="http://test",
+                headers={"Accept": "application/x-msgpack"},
+            ) as ac:
+
+                async def embed(item):
+                    response = await ac.post("/v1/embeddings", json={"input": [item], "model": MODEL_NAME})
+                    assert response.status_code == 200, f"Embedding API failed: {response.text}"
+                    return unpack_embeddings(response)[0]
+
+                if cache_path.exists():
+                    embedding = np.load(cache_path).astype(np.float32)
+                else:
+                    # The server reads the file itself, so no base64 round trip is needed
+                    embedding = await embed({"type": "image_path", "path": str(image_path)})
+                    np.save(cache_path, embedding.astype(np.float16))
+
+                _, query_embedding = await asyncio.gather(
+                    aclient.upsert(
+                        collection_name=collection_name,
+                        points=[models.PointStruct(id=1, vector=embedding, payload={"filename": "cats.jpg"})],
+                        wait=True,
+                    ),
+                    embed(query),
+                )
+                return query_embedding
+        finally:
+            await aclient.close()
+
+    # Run on the TestClient's event loop, which owns the server's batching engine
+    query_embedding = e2e_client.portal.call(embed_and_index)
+    enable_indexing(qdrant_client_fixture, collection_name)
 
+    # 5. Search
     # Query Qdrant
-    search_result = qdrant_client_fixture.query_points(collection_name=COLLECTION_NAME, query=query_embedding, limit=1)
+    search_result = qdrant_client_fixture.query_points(
+        collection_name=collection_name, query=query_embedding, limit=1, search_params=SEARCH_PARAMS
+    )
 
     assert len(search_result.points) > 0, "No results found"
     top_result = search_result.points[0]
@@ -121,76 +255,70 @@ def test_end_to_end_search(qdrant_client_fixture, e2e_client):
     assert top_result.score > 0.0, "Score should be positive"
 
 
-def test_end_to_end_image_search(qdrant_client_fixture, e2e_client):
-    """
-    E2E Test for Image-to-Image Search:
-    1. Create MultiVector collection in Qdrant.
-    2. Index 'cats.jpg' and 'desktop_setup.png'.
-    3. Query with 'cats.jpg' image.
-    4. Assert 'cats.jpg' is returned with a high score.
-    """
-    # 1. Cleanup Collection if exists
-    if qdrant_client_fixture.collection_exists(COLLECTION_NAME):
-        qdrant_client_fixture.delete_collection(COLLECTION_NAME)
+# The image-to-image case queries with cats-02.jpg, so it is kept out of the indexed corpus
+QUERY_ONLY_IMAGES = {"cats-02.jpg"}
 
-    # 2. Create Collection
-    qdrant_client_fixture.create_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=models.VectorParams(
-            size=VECTOR_SIZE,
-            distance=models.Distance.COSINE,
-            multivector_config=models.MultiVectorConfig(comparator=models.MultiVectorComparator.MAX_SIM),
-        ),
-    )
 
-    # 3. Prepare Data
-    repo_root = pathlib.Path(__file__).parent.parent
-    images_dir = repo_root / "images"
-    assert images_dir.exists(), f"Images directory not found at {images_dir}"
-
-    cats_02_path = images_dir / "cats-02.jpg"
-    assert cats_02_path.exists(), f"Query image not found at {cats_02_path}"
-
-    # 4. Index Images
-    # Helper function to embed and upsert
-    def index_image(path, idx):
-        uri = encode_image_to_base64(str(path))
-        fname = path.name
-        resp = e2e_client.post("/v1/embeddings", json={"input": [uri], "model": MODEL_NAME})
-        assert resp.status_code == 200, f"Embedding API failed for {fname}: {resp.text}"
-        emb = resp.json()["data"][0]["embedding"]
-        qdrant_client_fixture.upsert(
-            collection_name=COLLECTION_NAME,
-            points=[models.PointStruct(id=idx, vector=emb, payload={"filename": fname})],
-        )
-
-    # Index all images except cats-02.jpg
-    image_files = [
-        f for f in images_dir.iterdir() if f.suffix.lower() in [".jpg", ".jpeg", ".png"] and f.name != "cats-02.jpg"
+@pytest.fixture(scope="module")
+def indexed_collection(qdrant_client_fixture, available_images, e2e_client):
+    """
+    A collection holding every image except QUERY_ONLY_IMAGES, embedded in one batched
+    request and uploaded once for all search cases in the module.
+    """
+    name = f"e2e_corpus_{uuid.uuid4().hex}"
+    create_collection(qdrant_client_fixture, name)
+
+    names = [n for n in available_images if n not in QUERY_ONLY_IMAGES]
+    embeddings = batched_embed(e2e_client, [encode_image_to_base64(str(available_images[n])) for n in names])
+    points = [
+        models.PointStruct(id=i, vector=emb, payload={"filename": n})
+        for i, (n, emb) in enumerate(zip(names, embeddings), start=1)
     ]
-    for i, img_path in enumerate(image_files, start=1):
-        index_image(img_path, i)
-
-    # 5. Search with Image
-    # We query using the second cats image
-    cats_02_uri = encode_image_to_base64(str(cats_02_path))
-    resp_query = e2e_client.post("/v1/embeddings", json={"input": [cats_02_uri], "model": MODEL_NAME})
-    assert resp_query.status_code == 200, f"Query embedding failed: {resp_query.text}"
+    qdrant_client_fixture.upload_points(
+        collection_name=name,
+        points=points,
+        batch_size=UPLOAD_BATCH_SIZE,
+        parallel=UPLOAD_PARALLEL,
+        wait=True,
+    )
+    enable_indexing(qdrant_client_fixture, name)
+
+    yield name, len(points)
+    qdrant_client_fixture.delete_collection(name)
+
+
+@pytest.mark.parametrize(
+    "query,query_is_image,expected",
+    [
+        pytest.param("What's on the pink bed?", False, "cats.jpg", id="text"),
+        # Image-to-image search: the query is the file name of an image in IMAGES_DIR
+        pytest.param("cats-02.jpg", True, "cats.jpg", id="image"),
+    ],
+)
+def test_end_to_end_corpus_search(
+    query, query_is_image, expected, qdrant_client_fixture, indexed_collection, available_images, e2e_client
+):
+    """
+    E2E Test against the shared corpus: embed the query (text or image), search the
+    indexed collection and assert the expected image ranks first. Each case costs one
+    query-embedding forward pass, since the corpus is indexed once per module.
+    """
+    collection, corpus_size = indexed_collection
+    query_input = {"type": "image_path", "path": str(available_images[query])} if query_is_image else query
 
-    query_emb = resp_query.json()["data"][0]["embedding"]
+    query_emb = batched_embed(e2e_client, [query_input])[0]
 
     # Query Qdrant - get all results to print all scores
     search_result = qdrant_client_fixture.query_points(
-        collection_name=COLLECTION_NAME, query=query_emb, limit=len(image_files)
+        collection_name=collection, query=query_emb, limit=corpus_size, search_params=SEARCH_PARAMS
     )
 
     assert len(search_result.points) > 0, "No results found"
 
-    print("\nSearch results for cats-02.jpg:")
+    print(f"\nSearch results for {query!r}:")
     for hit in search_result.points:
         print(f"- {hit.payload['filename']}: {hit.score:.4f}")
 
     top_result = search_result.points[0]
-    assert top_result.payload["filename"] == "cats.jpg"
-    # Score should still be high as it's a similar image
+    assert top_result.payload["filename"] == expected
     assert top_result.score > 0.0, f"Score should be positive, got {top_result.score}"
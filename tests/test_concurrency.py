@@ -18,6 +18,7 @@ import base64
 import io
 import os
 import pathlib
+import threading
 import time
 from unittest.mock import AsyncMock, MagicMock, patch
 
@@ -25,6 +26,7 @@ import httpx
 import pytest
 from PIL import Image
 
+from mlx_embeddings_server.backend import BatchingEngine, PreparedBatch
 from mlx_embeddings_server.main import app
 
 MODEL_ID = "qnguyen3/colqwen2.5-v0.2-mlx"
@@ -52,6 +54,7 @@ def _make_mock_manager(latency: float = 0.03) -> MagicMock:
     mock = MagicMock()
     mock.model_id = MODEL_ID
     mock.batching_engine.start = AsyncMock()
+    mock.batching_engine.warmup = AsyncMock()
 
     async def _embed(inputs):
         await asyncio.sleep(latency)  # simulate GPU work
@@ -158,6 +161,114 @@ async def test_concurrent_no_embedding_cross_contamination():
         )
 
 
+class _RecordingEngine:
+    """Stand-in for BaseModel that records each batch passed through the two stages."""
+
+    def __init__(self, latency: float = 0.02):
+        self.latency = latency
+        self.batches = []
+
+    def preprocess(self, inputs):
+        batch = PreparedBatch(len(inputs), list(range(len(inputs))), [])
+        batch.text = list(inputs)
+        return batch
+
+    def forward(self, batch):
+        time.sleep(self.latency)  # simulate GPU work on the inference thread
+        self.batches.append(batch.text)
+        return [[[float(ord(inp[0]))]] for inp in batch.text]
+
+
+class _GatedEngine(_RecordingEngine):
+    """_RecordingEngine whose forward blocks until ``release`` is set, logging when each stage runs."""
+
+    def __init__(self):
+        super().__init__(latency=0)
+        self.release = threading.Event()
+        self.preprocessed = []
+        self.forwarding = []
+
+    def preprocess(self, inputs):
+        self.preprocessed.extend(inputs)
+        return super().preprocess(inputs)
+
+    def forward(self, batch):
+        self.forwarding.extend(batch.text)
+        assert self.release.wait(timeout=5), "forward was never released"
+        return super().forward(batch)
+
+
+async def _wait_for(condition, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the batching engine"
+        await asyncio.sleep(0.005)
+
+
+# BatchingEngine schedules forwards with asyncio.create_task, so these run on asyncio only
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+@pytest.mark.anyio
+async def test_batching_engine_pipelines_preprocess_with_forward():
+    """
+    While one forward is running, the next batch is preprocessed, and no more
+    than ``max_inflight`` batches are ever taken off the queue.
+    """
+    engine = _GatedEngine()
+    batching = BatchingEngine(engine, max_batch_size=1, max_wait_ms=0, max_inflight=2)
+    drain_task = asyncio.create_task(batching.start())
+    await asyncio.sleep(0)
+
+    try:
+        sentences = ["alpha", "brave", "cloud"]
+        tasks = [asyncio.create_task(batching.embed([s])) for s in sentences]
+
+        # Batch 2 is preprocessed while batch 1's forward is still blocked...
+        await _wait_for(lambda: len(engine.preprocessed) == 2)
+        assert engine.forwarding == ["alpha"]
+        # ...but batch 3 waits for an in-flight slot
+        await asyncio.sleep(0.05)
+        assert engine.preprocessed == ["alpha", "brave"]
+        assert not any(t.done() for t in tasks)
+
+        engine.release.set()
+        results = await asyncio.gather(*tasks)
+    finally:
+        engine.release.set()
+        drain_task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await drain_task
+
+    assert [r[0][0][0] for r in results] == [float(ord(s[0])) for s in sentences]
+    assert engine.batches == [["alpha"], ["brave"], ["cloud"]]
+
+
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+@pytest.mark.anyio
+async def test_batching_engine_coalesces():
+    """
+    The real BatchingEngine must coalesce concurrent requests and route each
+    result back to its caller.
+    """
+    engine = _RecordingEngine()
+    batching = BatchingEngine(engine, max_batch_size=64, max_wait_ms=10)
+    drain_task = asyncio.create_task(batching.start())
+    await asyncio.sleep(0)
+
+    try:
+        sentences = ["alpha", "brave", "cloud", "delta", "eagle"]
+        first = await asyncio.gather(*[batching.embed([s]) for s in sentences])
+        second = await asyncio.gather(*[batching.embed([s]) for s in sentences])
+    finally:
+        drain_task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await drain_task
+
+    for results in (first, second):
+        assert [r[0][0][0] for r in results] == [float(ord(s[0])) for s in sentences]
+    assert len(engine.batches) < 2 * len(sentences), "requests were not coalesced"
+    assert sorted(sum(engine.batches, [])) == sorted(sentences * 2)
+
+
 # ---------------------------------------------------------------------------
 # E2E tests — real MLX model loaded in-process via ASGI transport
 # ---------------------------------------------------------------------------
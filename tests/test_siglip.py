@@ -2,6 +2,7 @@ import base64
 import os
 import pathlib
 
+import orjson
 import pytest
 import torch
 from fastapi.testclient import TestClient
@@ -57,7 +58,8 @@ def test_siglip_end_to_end_search(e2e_client):
     # 2. Index Image
     response = e2e_client.post("/v1/embeddings", json={"input": [image_uri], "model": MODEL_NAME})
     assert response.status_code == 200, f"Embedding API failed: {response.text}"
-    image_embedding = response.json()["data"][0]["embedding"]
+    assert response.headers["content-type"] == "application/json"
+    image_embedding = orjson.loads(response.content)["data"][0]["embedding"]
 
     # 3. Search
     positive_query = "A photo of cats"
@@ -69,7 +71,8 @@ def test_siglip_end_to_end_search(e2e_client):
     )
     assert response_query.status_code == 200, f"Embedding API query failed: {response_query.text}"
 
-    data = response_query.json()["data"]
+    assert response_query.headers["content-type"] == "application/json"
+    data = orjson.loads(response_query.content)["data"]
     pos_embedding = data[0]["embedding"]
     neg_embedding = data[1]["embedding"]
 